@@ -19,10 +19,13 @@
   Linear modules."""
 
 from collections.abc import Iterable  # pylint: disable=g-importing-member
+import functools
+import operator
 
 from . import base
 from . import initializers
 
+import jax
 from jax import lax
 
 import jax.numpy as jnp
@@ -37,6 +40,271 @@ def _normalize_axes(axes, ndim):
   return tuple([ax if ax >= 0 else ndim + ax for ax in axes])
 
 
+def _cast(x, dtype):
+  """Casts `x` to `dtype`, without a convert op if the dtype already matches."""
+  if getattr(x, 'dtype', None) == dtype:
+    return x
+  return jnp.asarray(x, dtype)
+
+
+def _prod(xs):
+  """Product of a sequence of Python ints, without a NumPy dispatch."""
+  return functools.reduce(operator.mul, xs, 1)
+
+
+def _batched_init(initializer, rng, batch_size, shape, dtype):
+  """Initializes `batch_size` independent values of `shape` in a single call."""
+  if batch_size == 1:
+    return initializer(rng, shape, dtype)
+  rngs = jax.random.split(rng, batch_size)
+  return jax.vmap(lambda rng: initializer(rng, shape, dtype))(rngs)
+
+
+def _quantize(x, weight_dtype, reduce_axes):
+  """Quantizes `x` to `weight_dtype` with a scale per non-reduced index."""
+  amax = jnp.max(jnp.abs(x), axis=reduce_axes, keepdims=True)
+  if jnp.issubdtype(weight_dtype, jnp.integer):
+    scale = amax / float(jnp.iinfo(weight_dtype).max)
+  else:
+    scale = amax / float(jnp.finfo(weight_dtype).max)
+  scale = jnp.where(scale > 0, scale, jnp.ones_like(scale))
+  x = x / scale
+  if jnp.issubdtype(weight_dtype, jnp.integer):
+    x = jnp.round(x)
+  quantized = jnp.asarray(x, weight_dtype)
+  return quantized, jnp.squeeze(scale, axis=reduce_axes)
+
+
+def _quantized_param(module, name, shape, initializer, weight_dtype,
+                     reduce_axes):
+  """Defines a parameter stored in `weight_dtype` with a companion scale.
+
+  The full precision value is only materialized by `initializer` at init time.
+  The returned scale is stored as the parameter `name + '_scale'` and has the
+  shape of the parameter with the `reduce_axes` removed.
+  """
+  scales = []
+  def quantized_init(rng, shape):
+    quantized, scale = _quantize(initializer(rng, shape), weight_dtype,
+                                 reduce_axes)
+    scales.append(scale)
+    return quantized
+
+  value = module.param(name, shape, quantized_init)
+  scale_shape = tuple([d for i, d in enumerate(shape) if i not in reduce_axes])
+  scale = module.param(name + '_scale', scale_shape, lambda _, s: scales[0])
+  return value, scale
+
+
+# Number of kernel rows sharing a scale and zero point in 4 bit quantization.
+_INT4_GROUP_SIZE = 128
+
+
+def _quantize_int4(x, group_size):
+  """Asymmetric 4 bit quantization of a (in, out) kernel in groups of rows.
+
+  Returns:
+    The kernel packed as uint8 with shape (in, out // 2), holding two
+    consecutive output features per byte, and the float16 scales and zero
+    points with shape (in // group_size, out).
+  """
+  n_in, n_out = x.shape
+  groups = jnp.reshape(x, (n_in // group_size, group_size, n_out))
+  low, high = jnp.min(groups, axis=1), jnp.max(groups, axis=1)
+  scale = (high - low) / 15.
+  scale = jnp.where(scale > 0, scale, jnp.ones_like(scale))
+  zero = jnp.round(-low / scale)
+  q = jnp.clip(jnp.round(groups / scale[:, None]) + zero[:, None], 0, 15)
+  q = jnp.asarray(jnp.reshape(q, (n_in, n_out)), jnp.uint8)
+  packed = q[:, 0::2] | (q[:, 1::2] << 4)
+  return (packed, jnp.asarray(scale, jnp.float16),
+          jnp.asarray(zero, jnp.float16))
+
+
+def _dequantize_int4(packed, scale, zero, dtype):
+  """Inverse of `_quantize_int4`, returns a (in, out) kernel in `dtype`."""
+  n_in = packed.shape[0]
+  n_groups, n_out = scale.shape
+  q = jnp.stack([packed & 0xF, packed >> 4], axis=-1)
+  q = jnp.reshape(q, (n_groups, n_in // n_groups, n_out))
+  scale = jnp.asarray(scale, dtype)[:, None]
+  zero = jnp.asarray(zero, dtype)[:, None]
+  return jnp.reshape((jnp.asarray(q, dtype) - zero) * scale, (n_in, n_out))
+
+
+def _int4_params(module, shape, initializer):
+  """Defines a 4 bit quantized (in, out) kernel.
+
+  The packed kernel, scales and zero points of `_quantize_int4` are stored as
+  the parameters `kernel`, `kernel_scale` and `kernel_zero`.
+  """
+  n_in, n_out = shape
+  group_size = min(_INT4_GROUP_SIZE, n_in)
+  if n_in % group_size or n_out % 2:
+    raise ValueError('4 bit kernels require an even number of features and '
+                     'a number of input features divisible by %d, got shape '
+                     '%s.' % (group_size, str(shape)))
+  quantized = []
+  def packed_init(rng, shape):
+    quantized.extend(_quantize_int4(initializer(rng, shape), group_size))
+    return quantized[0]
+
+  packed = module.param('kernel', (n_in, n_out // 2),
+                        lambda rng, _: packed_init(rng, shape))
+  group_shape = (n_in // group_size, n_out)
+  scale = module.param('kernel_scale', group_shape, lambda *_: quantized[1])
+  zero = module.param('kernel_zero', group_shape, lambda *_: quantized[2])
+  return packed, scale, zero
+
+
+def _blocked_dot_general(lhs, rhs, dimension_numbers, precision, block_size):
+  """`lax.dot_general` with the innermost contracted axis split into blocks.
+
+  The blocks are multiplied one after another in a `lax.scan` and accumulated
+  in float32, which keeps the accumulator cache resident for very large
+  contractions. Without a `block_size`, or if the contracted axis fits in a
+  single block, this is a plain `lax.dot_general`.
+  """
+  (lhs_contract, rhs_contract), _ = dimension_numbers
+  # Block the contracted axis of `lhs` that is innermost in memory.
+  i = int(np.argmax(lhs_contract))
+  lhs_axis, rhs_axis = lhs_contract[i], rhs_contract[i]
+  size = lhs.shape[lhs_axis]
+  if block_size is None or size <= block_size:
+    return lax.dot_general(lhs, rhs, dimension_numbers, precision=precision)
+
+  n_blocks = -(-size // block_size)
+  def to_blocks(x, ax):
+    # Zero padding does not contribute to the contraction.
+    pad = [(0, 0)] * x.ndim
+    pad[ax] = (0, n_blocks * block_size - size)
+    x = jnp.pad(x, pad)
+    x = jnp.reshape(x, x.shape[:ax] + (n_blocks, block_size) + x.shape[ax + 1:])
+    # Every block keeps the rank and axis positions of the unblocked operand.
+    return jnp.moveaxis(x, ax, 0)
+
+  def block_product(lhs_block, rhs_block):
+    return lax.dot_general(lhs_block, rhs_block, dimension_numbers,
+                           precision=precision,
+                           preferred_element_type=jnp.float32)
+
+  lhs_blocks, rhs_blocks = to_blocks(lhs, lhs_axis), to_blocks(rhs, rhs_axis)
+  def body(acc, blocks):
+    return acc + block_product(*blocks), None
+  out, _ = lax.scan(body, block_product(lhs_blocks[0], rhs_blocks[0]),
+                    (lhs_blocks[1:], rhs_blocks[1:]))
+  return jnp.asarray(out, jnp.result_type(lhs, rhs))
+
+
+def _fp8_qdq(x, scale, fp8_dtype):
+  """Quantizes `x * scale` to `fp8_dtype` and dequantizes it again.
+
+  XLA recognizes this pattern around a matmul and rewrites it into an FP8
+  matmul on hardware that supports it.
+  """
+  fmax = float(jnp.finfo(fp8_dtype).max)
+  q = jnp.asarray(jnp.clip(x * scale, -fmax, fmax), fp8_dtype)
+  return jnp.asarray(jnp.asarray(q, jnp.float32) / scale, x.dtype)
+
+
+def _fp8_scale(amax, fp8_dtype):
+  """Scale mapping `amax` to the largest finite value of `fp8_dtype`."""
+  fmax = float(jnp.finfo(fp8_dtype).max)
+  return fmax / jnp.where(amax > 0, amax, jnp.ones_like(amax))
+
+
+@jax.custom_vjp
+def _fp8_grad_qdq(x):
+  """Identity which quantizes its incoming gradient to FP8 E5M2."""
+  return x
+
+
+def _fp8_grad_qdq_fwd(x):
+  return x, None
+
+
+def _fp8_grad_qdq_bwd(_, g):
+  # The backward pass cannot update an amax history, so gradients are scaled
+  # by their current amax.
+  amax = jnp.max(jnp.abs(jnp.asarray(g, jnp.float32)))
+  return (_fp8_qdq(g, _fp8_scale(amax, jnp.float8_e5m2), jnp.float8_e5m2),)
+
+
+_fp8_grad_qdq.defvjp(_fp8_grad_qdq_fwd, _fp8_grad_qdq_bwd)
+
+
+def _fp8_delayed_qdq(module, name, x, history_length, update_history):
+  """Quantizes `x` to FP8 E4M3 with a scale from its amax history.
+
+  The history of the absolute maxima of the last `history_length` calls is
+  kept in the state variable `name`. Until the history holds a value, the
+  current amax is used.
+  """
+  history = module.state(name, (history_length,), initializers.zeros)
+  amax = jnp.max(jnp.abs(jnp.asarray(x, jnp.float32)))
+  past_amax = jnp.max(history.value)
+  scale = _fp8_scale(jnp.where(past_amax > 0, past_amax, amax),
+                     jnp.float8_e4m3fn)
+  if update_history and not module.is_initializing():
+    history.value = jnp.concatenate([amax[None], history.value[:-1]])
+  return _fp8_qdq(x, lax.stop_gradient(scale), jnp.float8_e4m3fn)
+
+
+# Number of consecutive values sharing a scale in the MXFP8 format.
+_MX_BLOCK_SIZE = 32
+
+
+def _mx_quantize(x):
+  """Quantizes `x` to MXFP8 in blocks of 32 values along its last axis.
+
+  Returns:
+    The FP8 E4M3 values with the shape of `x`, and the shared power of two
+    scale of every block as E8M0, i.e. a uint8 exponent biased by 127, with
+    shape `x.shape[:-1] + (x.shape[-1] // 32,)`.
+  """
+  blocks = jnp.reshape(jnp.asarray(x, jnp.float32),
+                       x.shape[:-1] + (-1, _MX_BLOCK_SIZE))
+  amax = jnp.max(jnp.abs(blocks), axis=-1)
+  # 8 is the exponent of the largest normal E4M3 value.
+  exponent = jnp.floor(jnp.log2(jnp.where(amax > 0, amax, 1.))) - 8.
+  exponent = jnp.clip(jnp.where(amax > 0, exponent, -127.), -127., 127.)
+  fmax = float(jnp.finfo(jnp.float8_e4m3fn).max)
+  values = jnp.clip(blocks / jnp.exp2(exponent)[..., None], -fmax, fmax)
+  values = jnp.asarray(jnp.reshape(values, x.shape), jnp.float8_e4m3fn)
+  return values, jnp.asarray(exponent + 127., jnp.uint8)
+
+
+def _mx_dequantize(values, scale, dtype):
+  """Inverse of `_mx_quantize`, returns the values in `dtype`."""
+  blocks = jnp.reshape(jnp.asarray(values, jnp.float32),
+                       values.shape[:-1] + (-1, _MX_BLOCK_SIZE))
+  blocks = blocks * jnp.exp2(jnp.asarray(scale, jnp.float32) - 127.)[..., None]
+  return jnp.asarray(jnp.reshape(blocks, values.shape), dtype)
+
+
+def _mxfp8_params(module, shape, initializer):
+  """Defines an MXFP8 (in, out) kernel blocked along the input features.
+
+  The E4M3 values are stored as the parameter `kernel` with shape (in, out)
+  and the E8M0 scales as `kernel_scale` with shape (in // 32, out).
+  """
+  n_in, n_out = shape
+  if n_in % _MX_BLOCK_SIZE:
+    raise ValueError('MXFP8 kernels require a number of input features '
+                     'divisible by %d, got shape %s.'
+                     % (_MX_BLOCK_SIZE, str(shape)))
+  quantized = []
+  def kernel_init(rng, shape):
+    values, scale = _mx_quantize(jnp.transpose(initializer(rng, shape)))
+    quantized.append(jnp.transpose(scale))
+    return jnp.transpose(values)
+
+  kernel = module.param('kernel', shape, kernel_init)
+  scale = module.param('kernel_scale', (n_in // _MX_BLOCK_SIZE, n_out),
+                       lambda *_: quantized[0])
+  return kernel, scale
+
+
 class DenseGeneral(base.Module):
   """DEPRECATION WARNING:
   The `flax.nn` module is Deprecated, use `flax.linen` instead. 
@@ -50,10 +318,12 @@ class DenseGeneral(base.Module):
             axis=-1,
             batch_dims=(),
             bias=True,
-            dtype=jnp.float32,
+            dtype=jnp.bfloat16,
             kernel_init=default_kernel_init,
             bias_init=initializers.zeros,
-            precision=None):
+            precision=None,
+            weight_dtype=None,
+            contract_block_size=None):
     """Applies a linear transformation to the inputs along multiple dimensions.
 
     Args:
@@ -62,11 +332,20 @@ class DenseGeneral(base.Module):
       axis: tuple with axes to apply the transformation on.
       batch_dims: tuple with batch axes.
       bias: whether to add a bias to the output (default: True).
-      dtype: the dtype of the computation (default: float32).
+      dtype: the dtype of the computation (default: bfloat16).
       kernel_init: initializer function for the weight matrix.
       bias_init: initializer function for the bias.
       precision: numerical precision of the computation see `jax.lax.Precision`
         for details.
+      weight_dtype: optional dtype (e.g. `jnp.float8_e4m3fn`) in which the
+        kernel is stored. The kernel is then scaled per output feature by an
+        additional `kernel_scale` parameter (default: None, the kernel is stored
+        in full precision).
+      contract_block_size: optional block size for very large contractions.
+        The innermost contracted axis (or all contracted axes, if they are the
+        trailing input axes) is split into blocks of this size, which are
+        multiplied sequentially and accumulated in float32 (default: None, the
+        contraction is not blocked).
     Returns:
       The transformed input.
     """
@@ -81,7 +360,7 @@ class DenseGeneral(base.Module):
     features, axis, batch_dims = tuple(features), tuple(axis), tuple(batch_dims)
 
     if batch_dims:
-      max_dim = np.max(batch_dims)
+      max_dim = max(batch_dims)
       if set(batch_dims) != set(range(max_dim + 1)):
         raise ValueError('batch_dims %s must be consecutive leading '
                          'dimensions starting from 0.' % str(batch_dims))
@@ -91,43 +370,80 @@ class DenseGeneral(base.Module):
     axis = _normalize_axes(axis, ndim)
     batch_dims = _normalize_axes(batch_dims, ndim)
     n_axis, n_features = len(axis), len(features)
+    # Number of input axes which are neither contracted nor batch axes.
+    n_other = ndim - n_axis - n_batch_dims
 
     def kernel_init_wrap(rng, shape, dtype=jnp.float32):
-      size_batch_dims = np.prod(shape[:n_batch_dims], dtype=np.int32)
-      flat_shape = (np.prod(shape[n_batch_dims:n_axis + n_batch_dims]),
-                    np.prod(shape[-n_features:]),)
-      kernel = jnp.concatenate([kernel_init(rng, flat_shape, dtype)
-                                for _ in range(size_batch_dims)], axis=0)
+      size_batch_dims = _prod(shape[:n_batch_dims])
+      flat_shape = (_prod(shape[n_batch_dims:n_axis + n_batch_dims]),
+                    _prod(shape[-n_features:]),)
+      kernel = _batched_init(kernel_init, rng, size_batch_dims, flat_shape,
+                             dtype)
       return jnp.reshape(kernel, shape)
 
     batch_shape = tuple([inputs.shape[ax] for ax in batch_dims])
     kernel_shape = tuple([inputs.shape[ax] for ax in axis]) + features
-    kernel = self.param('kernel', batch_shape + kernel_shape, kernel_init_wrap)
-    kernel = jnp.asarray(kernel, dtype)
-
     batch_ind = tuple(range(n_batch_dims))
     contract_ind = tuple(range(n_batch_dims, n_axis + n_batch_dims))
-    out = lax.dot_general(inputs,
-                          kernel,
-                          ((axis, contract_ind), (batch_dims, batch_ind)),
-                          precision=precision)
+    if weight_dtype is None:
+      kernel = self.param('kernel', batch_shape + kernel_shape,
+                          kernel_init_wrap)
+    else:
+      kernel, kernel_scale = _quantized_param(
+          self, 'kernel', batch_shape + kernel_shape, kernel_init_wrap,
+          weight_dtype, contract_ind)
+    kernel = jnp.asarray(kernel, dtype)
+
+    # Prepare the broadcastable bias ahead of the matmul such that only
+    # elementwise ops (the optional kernel scale and the bias add) follow the
+    # dot_general, which XLA fuses into its output.
+    out_bias = None
     if bias:
       def bias_init_wrap(rng, shape, dtype=jnp.float32):
-        size_batch_dims = np.prod(shape[:n_batch_dims], dtype=np.int32)
-        flat_shape = (np.prod(shape[-n_features:]),)
-        bias = jnp.concatenate([bias_init(rng, flat_shape, dtype)
-                                for _ in range(size_batch_dims)], axis=0)
+        size_batch_dims = _prod(shape[:n_batch_dims])
+        flat_shape = (_prod(shape[-n_features:]),)
+        bias = _batched_init(bias_init, rng, size_batch_dims, flat_shape,
+                             dtype)
         return jnp.reshape(bias, shape)
 
-      bias = self.param('bias', batch_shape + features, bias_init_wrap)
+      out_bias = self.param('bias', batch_shape + features, bias_init_wrap)
 
-      # Reshape bias for broadcast.
-      expand_dims = sorted(
-          set(range(inputs.ndim)) - set(axis) - set(batch_dims))
-      for ax in expand_dims:
-        bias = jnp.expand_dims(bias, ax)
-      bias = jnp.asarray(bias, dtype)
-      out = out + bias
+      # Reshape bias for broadcast against the (batch, other, features) axes of
+      # the output.
+      out_bias = jnp.reshape(out_bias, batch_shape + (1,) * n_other + features)
+      out_bias = jnp.asarray(out_bias, dtype)
+
+    if (n_axis > 1 or n_features > 1) and axis == tuple(
+        range(ndim - n_axis, ndim)):
+      # The contracted axes are trailing, so the multi-axis contraction can be
+      # flattened into a single (batched) 2D matmul using only free reshapes.
+      other_shape = inputs.shape[n_batch_dims:ndim - n_axis]
+      contract_size = _prod(inputs.shape[ndim - n_axis:])
+      flat_inputs = jnp.reshape(
+          inputs, batch_shape + (_prod(other_shape), contract_size))
+      flat_kernel = jnp.reshape(
+          kernel, batch_shape + (contract_size, _prod(features)))
+      out = _blocked_dot_general(flat_inputs,
+                                 flat_kernel,
+                                 (((n_batch_dims + 1,), (n_batch_dims,)),
+                                  (batch_ind, batch_ind)),
+                                 precision,
+                                 contract_block_size)
+      out = jnp.reshape(out, batch_shape + other_shape + features)
+    else:
+      out = _blocked_dot_general(
+          inputs,
+          kernel,
+          ((axis, contract_ind), (batch_dims, batch_ind)),
+          precision,
+          contract_block_size)
+    if weight_dtype is not None:
+      # The scale only varies along the batch and feature axes of the output.
+      kernel_scale = jnp.reshape(
+          kernel_scale, batch_shape + (1,) * n_other + features)
+      out = out * jnp.asarray(kernel_scale, dtype)
+    if out_bias is not None:
+      out = out + out_bias
     return out
 
 
@@ -142,50 +458,330 @@ class Dense(base.Module):
             inputs,
             features,
             bias=True,
-            dtype=jnp.float32,
+            dtype=jnp.bfloat16,
             precision=None,
             kernel_init=default_kernel_init,
-            bias_init=initializers.zeros):
+            bias_init=initializers.zeros,
+            weight_dtype=None,
+            weight_bits=None,
+            num_heads=None,
+            fp8_history_length=None,
+            update_fp8_history=True,
+            mxfp8=False):
     """Applies a linear transformation to the inputs along the last dimension.
 
     Args:
       inputs: The nd-array to be transformed.
       features: the number of output features.
       bias: whether to add a bias to the output (default: True).
-      dtype: the dtype of the computation (default: float32).
+      dtype: the dtype of the computation (default: bfloat16).
       precision: numerical precision of the computation see `jax.lax.Precision`
         for details.
       kernel_init: initializer function for the weight matrix.
       bias_init: initializer function for the bias.
+      weight_dtype: optional dtype (e.g. `jnp.float8_e4m3fn`) in which the
+        kernel is stored. The kernel is then scaled per output feature by an
+        additional `kernel_scale` parameter (default: None, the kernel is stored
+        in full precision).
+      weight_bits: optional number of bits of a weight-only quantized kernel.
+        Only 4 is supported: the kernel is then stored as a uint8 `kernel`
+        with two values per byte, together with float16 `kernel_scale` and
+        `kernel_zero` parameters per group of 128 input features
+        (default: None).
+      num_heads: optional number of independent transformations applied in a
+        single batched matmul. The leading dimension of `inputs` then indexes
+        the heads, and the kernel and bias get a leading `num_heads` dimension
+        (default: None).
+      fp8_history_length: optional length of the amax histories used for FP8
+        training with delayed scaling. The inputs and kernel are then
+        quantized to FP8 E4M3 with scales derived from the largest absolute
+        values seen in the previous calls, and the gradient of the output is
+        quantized to FP8 E5M2. The histories are stored as the state variables
+        `input_amax_history` and `kernel_amax_history`, which requires a
+        `flax.nn.stateful` context (default: None).
+      update_fp8_history: whether to record the current amax in the FP8
+        histories, e.g. disable this for evaluation with frozen state
+        (default: True).
+      mxfp8: whether to store the kernel in the MXFP8 format, i.e. as FP8 E4M3
+        values in `kernel` with an E8M0 scale per block of 32 input features in
+        `kernel_scale`. The inputs are quantized to MXFP8 along their last
+        dimension as well (default: False).
     Returns:
       The transformed input.
     """
-    inputs = jnp.asarray(inputs, dtype)
-    kernel = self.param('kernel', (inputs.shape[-1], features), kernel_init)
-    kernel = jnp.asarray(kernel, dtype)
-    y = lax.dot_general(inputs, kernel,
-                        (((inputs.ndim - 1,), (0,)), ((), ())),
-                        precision=precision)
+    inputs = jnp.asarray(inputs)
+    if weight_bits is not None and (weight_bits != 4 or
+                                   weight_dtype is not None):
+      raise ValueError('weight_bits must be 4 and cannot be combined with '
+                       'weight_dtype, got %r.' % weight_bits)
+    if mxfp8 and (weight_bits is not None or weight_dtype is not None or
+                  num_heads is not None or fp8_history_length is not None):
+      raise ValueError('mxfp8 cannot be combined with other quantization '
+                       'options or num_heads.')
+    if fp8_history_length is not None:
+      if (weight_bits is not None or weight_dtype is not None or
+          num_heads is not None):
+        raise ValueError('fp8_history_length cannot be combined with '
+                         'quantized kernels or num_heads.')
+      if not self.is_stateful():
+        raise ValueError('FP8 training requires a flax.nn.stateful context '
+                         'for the amax histories.')
+    if num_heads is not None:
+      if weight_bits is not None or weight_dtype is not None:
+        raise ValueError('num_heads cannot be combined with quantized '
+                         'kernels.')
+      if inputs.shape[0] != num_heads:
+        raise ValueError('The leading dimension of inputs %s must equal '
+                         'num_heads=%d.' % (str(inputs.shape), num_heads))
+      def heads_init(init):
+        return lambda rng, shape, dtype=jnp.float32: jnp.reshape(
+            _batched_init(init, rng, num_heads, shape[1:], dtype), shape)
+      kernel = self.param('kernel', (num_heads, inputs.shape[-1], features),
+                          heads_init(kernel_init))
+      out_bias = None
+      if bias:
+        out_bias = self.param('bias', (num_heads, features),
+                              heads_init(bias_init))
+      return _dense(inputs, kernel, None, out_bias, dtype, precision)
+
+    kernel_shape = (inputs.shape[-1], features)
+    out_bias = None
     if bias:
-      bias = self.param('bias', (features,), bias_init)
-      bias = jnp.asarray(bias, dtype)
-      y = y + bias
-    return y
+      out_bias = self.param('bias', (features,), bias_init)
+    if mxfp8:
+      kernel, kernel_scale = _mxfp8_params(self, kernel_shape, kernel_init)
+      return _dense_mxfp8(inputs, kernel, kernel_scale, out_bias, dtype,
+                          precision)
+    if weight_bits is not None:
+      kernel, kernel_scale, kernel_zero = _int4_params(
+          self, kernel_shape, kernel_init)
+      return _dense_int4(inputs, kernel, kernel_scale, kernel_zero, out_bias,
+                         dtype, precision)
+
+    kernel_scale = None
+    if weight_dtype is None:
+      kernel = self.param('kernel', kernel_shape, kernel_init)
+    else:
+      kernel, kernel_scale = _quantized_param(
+          self, 'kernel', kernel_shape, kernel_init, weight_dtype, (0,))
+    if fp8_history_length is not None:
+      inputs = _fp8_delayed_qdq(self, 'input_amax_history', inputs,
+                                fp8_history_length, update_fp8_history)
+      kernel = _fp8_delayed_qdq(self, 'kernel_amax_history', kernel,
+                                fp8_history_length, update_fp8_history)
+      y = _dense(inputs, kernel, None, None, dtype, precision)
+      y = _fp8_grad_qdq(y)
+      if out_bias is not None:
+        y = y + _cast(out_bias, dtype)
+      return y
+    return _dense(inputs, kernel, kernel_scale, out_bias, dtype, precision)
 
 
-def _conv_dimension_numbers(input_shape):
+@functools.partial(jax.jit, static_argnums=(4, 5))
+def _dense(inputs, kernel, kernel_scale, bias, dtype, precision):
+  """Computes `Dense`, compiled once per shape, dtype and precision.
+
+  A kernel of rank 3 holds one (in, out) kernel per head, which is applied to
+  the corresponding entry along the leading axis of `inputs`.
+  """
+  inputs = _cast(inputs, dtype)
+  kernel = _cast(kernel, dtype)
+  if kernel.ndim == 3:
+    dimension_numbers = (((inputs.ndim - 1,), (1,)), ((0,), (0,)))
+  else:
+    dimension_numbers = (((inputs.ndim - 1,), (0,)), ((), ()))
+  y = lax.dot_general(inputs, kernel, dimension_numbers, precision=precision)
+  if kernel_scale is not None:
+    y = y * _cast(kernel_scale, dtype)
+  if bias is not None:
+    if bias.ndim == 2:
+      bias = jnp.reshape(bias, bias.shape[:1] + (1,) * (y.ndim - 2)
+                         + bias.shape[1:])
+    y = y + _cast(bias, dtype)
+  return y
+
+
+@functools.partial(jax.jit, static_argnums=(5, 6))
+def _dense_int4(inputs, kernel, kernel_scale, kernel_zero, bias, dtype,
+                precision):
+  """Computes `Dense` with a 4 bit kernel, dequantized within the same jit."""
+  kernel = _dequantize_int4(kernel, kernel_scale, kernel_zero, dtype)
+  return _dense(inputs, kernel, None, bias, dtype, precision)
+
+
+@functools.partial(jax.jit, static_argnums=(4, 5))
+def _dense_mxfp8(inputs, kernel, kernel_scale, bias, dtype, precision):
+  """Computes `Dense` with an MXFP8 kernel and MXFP8 quantized inputs.
+
+  Both operands are dequantized right before the matmul, a pattern which XLA
+  can lower to a block scaled FP8 matmul on hardware that supports it.
+  """
+  inputs = _mx_dequantize(*_mx_quantize(inputs), dtype)
+  kernel = jnp.transpose(_mx_dequantize(
+      jnp.transpose(kernel), jnp.transpose(kernel_scale), dtype))
+  return _dense(inputs, kernel, None, bias, dtype, precision)
+
+
+@functools.lru_cache(maxsize=8)
+def _conv_dimension_numbers(ndim, channels_first=False):
   """DEPRECATION WARNING:
   The `flax.nn` module is Deprecated, use `flax.linen` instead. 
   Learn more and find an upgrade guide at 
   https://github.com/google/flax/blob/master/flax/linen/README.md"
-  Computes the dimension numbers based on the input shape."""
-  ndim = len(input_shape)
-  lhs_spec = (0, ndim - 1) + tuple(range(1, ndim - 1))
+  Computes the dimension numbers based on the input rank and layout."""
+  if channels_first:
+    lhs_spec = tuple(range(ndim))
+  else:
+    lhs_spec = (0, ndim - 1) + tuple(range(1, ndim - 1))
   rhs_spec = (ndim - 1, ndim - 2) + tuple(range(0, ndim - 2))
   out_spec = lhs_spec
   return lax.ConvDimensionNumbers(lhs_spec, rhs_spec, out_spec)
 
 
+def _to_channels_first(x):
+  """Transposes (batch, spatial_dims..., features) to channels first."""
+  # A single batched 2D transpose over the flattened spatial dimensions.
+  flat = jnp.reshape(x, (x.shape[0], -1, x.shape[-1]))
+  flat = jnp.swapaxes(flat, 1, 2)
+  return jnp.reshape(flat, (x.shape[0], x.shape[-1]) + x.shape[1:-1])
+
+
+def _to_channels_last(x):
+  """Transposes (batch, features, spatial_dims...) to channels last."""
+  flat = jnp.reshape(x, x.shape[:2] + (-1,))
+  flat = jnp.swapaxes(flat, 1, 2)
+  return jnp.reshape(flat, (x.shape[0],) + x.shape[2:] + (x.shape[1],))
+
+
+# Transformation matrices of the Winograd F(2x2, 3x3) algorithm.
+_WINOGRAD_BT = np.array([[1., 0., -1., 0.],
+                         [0., 1., 1., 0.],
+                         [0., -1., 1., 0.],
+                         [0., 1., 0., -1.]])
+_WINOGRAD_G = np.array([[1., 0., 0.],
+                        [.5, .5, .5],
+                        [.5, -.5, .5],
+                        [0., 0., 1.]])
+_WINOGRAD_AT = np.array([[1., 1., 1., 0.],
+                         [0., 1., -1., -1.]])
+
+
+def _winograd_kernel(kernel):
+  """Transforms a (3, 3, in, out) kernel into the (4, 4, in, out) domain."""
+  g = jnp.asarray(_WINOGRAD_G, kernel.dtype)
+  return jnp.einsum('ia,jb,abco->ijco', g, g, kernel)
+
+
+def _winograd_conv(inputs, wino_kernel, padding, feature_group_count,
+                   precision):
+  """Stride 1 2D convolution with a Winograd F(2x2, 3x3) transformed kernel.
+
+  Args:
+    inputs: input data with dimensions (batch, height, width, features).
+    wino_kernel: kernel transformed by `_winograd_kernel`.
+    padding: `'SAME'`, `'VALID'` or a sequence of 2 `(low, high)` pairs.
+    feature_group_count: number of groups the input features are divided in.
+    precision: numerical precision of the computation see
+      `jax.lax.Precision` for details.
+  Returns:
+    The convolved data.
+  """
+  if isinstance(padding, str):
+    padding = lax.padtype_to_pads(inputs.shape[1:3], (3, 3), (1, 1), padding)
+  (pad_h, pad_w) = padding
+  out_h = inputs.shape[1] + pad_h[0] + pad_h[1] - 2
+  out_w = inputs.shape[2] + pad_w[0] + pad_w[1] - 2
+  tiles_h, tiles_w = -(-out_h // 2), -(-out_w // 2)
+  # Pad the high end such that the output is covered by complete 2x2 tiles.
+  inputs = jnp.pad(inputs, ((0, 0),
+                            (pad_h[0], 2 * tiles_h - out_h + pad_h[1]),
+                            (pad_w[0], 2 * tiles_w - out_w + pad_w[1]),
+                            (0, 0)))
+
+  # Overlapping 4x4 input tiles with stride 2 in the (alpha, alpha, P, CI)
+  # layout, where P enumerates the tiles of all images.
+  tiles = jnp.stack([
+      jnp.stack([inputs[:, a:a + 2 * tiles_h:2, b:b + 2 * tiles_w:2]
+                 for b in range(4)])
+      for a in range(4)])
+  bt = jnp.asarray(_WINOGRAD_BT, inputs.dtype)
+  data = jnp.einsum('ia,jb,abnhwc->ijnhwc', bt, bt, tiles,
+                    precision=precision)
+
+  batch, in_features = inputs.shape[0], inputs.shape[-1]
+  features = wino_kernel.shape[-1]
+  n_tiles = batch * tiles_h * tiles_w
+  group_in = in_features // feature_group_count
+  group_out = features // feature_group_count
+  data = jnp.reshape(data, (4, 4, n_tiles, feature_group_count, group_in))
+  wino_kernel = jnp.reshape(
+      wino_kernel, (4, 4, group_in, feature_group_count, group_out))
+  # One matmul per (alpha, alpha, group) entry.
+  out = lax.dot_general(data, wino_kernel,
+                        (((4,), (2,)), ((0, 1, 3), (0, 1, 3))),
+                        precision=precision)
+  out = jnp.reshape(jnp.swapaxes(out, 2, 3),
+                    (4, 4, batch, tiles_h, tiles_w, features))
+
+  at = jnp.asarray(_WINOGRAD_AT, out.dtype)
+  y = jnp.einsum('ri,sj,ijnhwo->nhrwso', at, at, out, precision=precision)
+  y = jnp.reshape(y, (batch, 2 * tiles_h, 2 * tiles_w, features))
+  return y[:, :out_h, :out_w]
+
+
+# Largest patch size `prod(kernel_size) * in_features` for which `Conv` uses
+# im2col when requested, such that the patches stay cache resident.
+_IM2COL_MAX_PATCH_SIZE = 4096
+
+
+def _im2col_conv(inputs, kernel, strides, padding, input_dilation,
+                 kernel_dilation, feature_group_count, precision):
+  """Convolution as an explicit patch extraction followed by a matmul.
+
+  Args:
+    inputs: input data with dimensions (batch, spatial_dims..., features).
+    kernel: kernel with dimensions (spatial_dims..., in_features // groups,
+      features).
+    strides: a sequence of `n` integers, representing the inter-window strides.
+    padding: `'SAME'`, `'VALID'` or a sequence of `n` `(low, high)` pairs.
+    input_dilation: `None`, or a sequence of `n` integers.
+    kernel_dilation: `None`, or a sequence of `n` integers.
+    feature_group_count: number of groups the input features are divided in.
+    precision: numerical precision of the matmul see `jax.lax.Precision` for
+      details.
+  Returns:
+    The convolved data.
+  """
+  kernel_size = kernel.shape[:-2]
+  group_in, features = kernel.shape[-2:]
+  # Patch extraction is itself a convolution with a one-hot kernel, highest
+  # precision keeps the extracted values exact.
+  patches = lax.conv_general_dilated_patches(
+      inputs,
+      kernel_size,
+      strides,
+      padding,
+      lhs_dilation=input_dilation,
+      rhs_dilation=kernel_dilation,
+      dimension_numbers=_conv_dimension_numbers(inputs.ndim),
+      precision=lax.Precision.HIGHEST)
+  # Patch features are ordered as (in_features, spatial_dims...).
+  n_spatial = len(kernel_size)
+  kernel = jnp.transpose(
+      kernel, (n_spatial,) + tuple(range(n_spatial)) + (n_spatial + 1,))
+  group_size = group_in * _prod(kernel_size)
+  kernel = jnp.reshape(kernel, (group_size, feature_group_count, -1))
+  patches = jnp.reshape(
+      patches, patches.shape[:-1] + (feature_group_count, group_size))
+  # One matmul per feature group.
+  y = lax.dot_general(patches, kernel,
+                      (((patches.ndim - 1,), (0,)),
+                       ((patches.ndim - 2,), (1,))),
+                      precision=precision)
+  y = jnp.moveaxis(y, 0, -2)
+  return jnp.reshape(y, y.shape[:-2] + (features,))
+
+
 class Conv(base.Module):
   """DEPRECATION WARNING:
   The `flax.nn` module is Deprecated, use `flax.linen` instead. 
@@ -203,10 +799,13 @@ class Conv(base.Module):
             kernel_dilation=None,
             feature_group_count=1,
             bias=True,
-            dtype=jnp.float32,
+            dtype=jnp.bfloat16,
             precision=None,
             kernel_init=default_kernel_init,
-            bias_init=initializers.zeros):
+            bias_init=initializers.zeros,
+            winograd=False,
+            data_format=None,
+            im2col=False):
     """Applies a convolution to the inputs.
 
     Args:
@@ -231,16 +830,30 @@ class Conv(base.Module):
       feature_group_count: integer, default 1. If specified divides the input
         features into groups.
       bias: whether to add a bias to the output (default: True).
-      dtype: the dtype of the computation (default: float32).
+      dtype: the dtype of the computation (default: bfloat16).
       precision: numerical precision of the computation see `jax.lax.Precision`
         for details.
       kernel_init: initializer for the convolutional kernel.
       bias_init: initializer for the bias.
+      winograd: whether to compute the convolution with the Winograd
+        F(2x2, 3x3) algorithm. Only supported for 2D convolutions with a 3x3
+        kernel, unit strides and no dilation. The kernel is transformed into
+        the Winograd domain on every call, such that the parameters stay
+        compatible with the regular convolution (default: False).
+      data_format: the layout in which the convolution is computed, either
+        `'NHWC'` (channels last) or `'NCHW'` (channels first). Inputs and
+        outputs are always channels last. By default `'NCHW'` is used for
+        grouped convolutions on GPU and `'NHWC'` otherwise. `'NCHW'` cannot
+        be combined with `winograd` or `im2col`.
+      im2col: whether to compute the convolution by extracting the input
+        patches and multiplying them with the kernel in a single matmul. Only
+        used when `prod(kernel_size) * in_features <= 4096`, otherwise the
+        regular convolution is computed (default: False).
     Returns:
       The convolved data.
     """
 
-    inputs = jnp.asarray(inputs, dtype)
+    inputs = _cast(inputs, dtype)
     if isinstance(kernel_size, int):
       kernel_size = (kernel_size,)
 
@@ -255,27 +868,63 @@ class Conv(base.Module):
     in_features = inputs.shape[-1]
     assert in_features % feature_group_count == 0
     kernel_shape = kernel_size + (in_features // feature_group_count, features)
-    kernel = self.param('kernel', kernel_shape, kernel_init)
-    kernel = jnp.asarray(kernel, dtype)
 
-    dimension_numbers = _conv_dimension_numbers(inputs.shape)
-    y = lax.conv_general_dilated(
-        inputs,
-        kernel,
-        strides,
-        padding,
-        lhs_dilation=input_dilation,
-        rhs_dilation=kernel_dilation,
-        dimension_numbers=dimension_numbers,
-        feature_group_count=feature_group_count,
-        precision=precision)
+    if winograd and im2col:
+      raise ValueError('winograd and im2col cannot be combined.')
+    if data_format not in (None, 'NHWC', 'NCHW'):
+      raise ValueError('data_format must be "NHWC" or "NCHW", got %r.'
+                       % data_format)
+    im2col = (im2col and
+              _prod(kernel_size) * in_features <= _IM2COL_MAX_PATCH_SIZE)
+    if data_format == 'NCHW' and (winograd or im2col):
+      raise ValueError('data_format "NCHW" cannot be combined with winograd or '
+                       'im2col.')
+    if winograd:
+      is_unit = lambda xs: xs is None or all(x == 1 for x in xs)
+      if (tuple(kernel_size) != (3, 3) or not is_unit(strides) or
+          not is_unit(input_dilation) or not is_unit(kernel_dilation)):
+        raise ValueError('Winograd convolution requires a 3x3 kernel, unit '
+                         'strides and no dilation.')
+      kernel = self.param('kernel', kernel_shape, kernel_init)
+      wino_kernel = _cast(_winograd_kernel(kernel), dtype)
+      y = _winograd_conv(inputs, wino_kernel, padding, feature_group_count,
+                         precision)
+    elif im2col:
+      kernel = self.param('kernel', kernel_shape, kernel_init)
+      kernel = _cast(kernel, dtype)
+      y = _im2col_conv(inputs, kernel, strides, padding, input_dilation,
+                       kernel_dilation, feature_group_count, precision)
+    else:
+      kernel = self.param('kernel', kernel_shape, kernel_init)
+      kernel = _cast(kernel, dtype)
+
+      if data_format is None:
+        use_nchw = (feature_group_count > 1 and
+                    jax.default_backend() == 'gpu')
+        data_format = 'NCHW' if use_nchw else 'NHWC'
+      channels_first = data_format == 'NCHW'
+      if channels_first:
+        inputs = _to_channels_first(inputs)
+
+      dimension_numbers = _conv_dimension_numbers(inputs.ndim, channels_first)
+      y = lax.conv_general_dilated(
+          inputs,
+          kernel,
+          strides,
+          padding,
+          lhs_dilation=input_dilation,
+          rhs_dilation=kernel_dilation,
+          dimension_numbers=dimension_numbers,
+          feature_group_count=feature_group_count,
+          precision=precision)
+      if channels_first:
+        y = _to_channels_last(y)
 
     if is_single_input:
       y = jnp.squeeze(y, axis=0)
     if bias:
       bias = self.param('bias', (features,), bias_init)
-      bias = jnp.asarray(bias, dtype)
-      y = y + bias
+      y = y + _cast(bias, dtype)
     return y
 
 
@@ -357,6 +1006,39 @@ default_embed_init = initializers.variance_scaling(1.0, 'fan_in', 'normal',
                                                    out_axis=0)
 
 
+@jax.custom_vjp
+def _sorted_grad_lookup(embedding, inputs):
+  """Gathers rows of `embedding` with a scatter-free backward pass."""
+  return embedding[inputs]
+
+
+def _sorted_grad_lookup_fwd(embedding, inputs):
+  return embedding[inputs], (embedding.shape[0], inputs)
+
+
+def _sorted_grad_lookup_bwd(res, g):
+  num_embeddings, inputs = res
+  # Wrap negative indices like the forward gather. As in the gradient of the
+  # gather, out of range indices are dropped by `segment_sum`.
+  ids = jnp.ravel(inputs)
+  ids = jnp.where((ids < 0) & (ids >= -num_embeddings),
+                  ids + num_embeddings, ids)
+  g = jnp.reshape(g, (ids.shape[0], g.shape[-1]))
+  # Sorting turns the scatter-add into a segmented reduction over contiguous
+  # runs of equal indices.
+  order = jnp.argsort(ids)
+  grad = jax.ops.segment_sum(g[order], ids[order], num_embeddings,
+                             indices_are_sorted=True)
+  return grad, None
+
+
+_sorted_grad_lookup.defvjp(_sorted_grad_lookup_fwd, _sorted_grad_lookup_bwd)
+
+
+def _dequantize_rows(embedding, scale):
+  return jnp.asarray(embedding, scale.dtype) * scale[:, None]
+
+
 class Embed(base.Module):
   """DEPRECATION WARNING:
   The `flax.nn` module is Deprecated, use `flax.linen` instead. 
@@ -371,7 +1053,10 @@ class Embed(base.Module):
             inputs,
             num_embeddings,
             features,
-            embedding_init=default_embed_init):
+            embedding_init=default_embed_init,
+            one_hot=False,
+            sorted_grad=False,
+            embedding_dtype=None):
     """Embeds the inputs along the last dimension.
 
     Args:
@@ -379,6 +1064,19 @@ class Embed(base.Module):
       num_embeddings: number of embeddings.
       features: Number of feature dimensions for each embedding.
       embedding_init: embedding initializer.
+      one_hot: whether to compute the lookup as a matmul of the one-hot encoded
+        inputs with the embedding instead of a gather. This can be faster on
+        accelerators for small vocabularies. Unlike the gather, out of range
+        (including negative) inputs are then embedded as zeros
+        (default: False).
+      sorted_grad: whether the gradient of a gather lookup is computed by
+        sorting the inputs and summing contiguous segments instead of a
+        scatter-add. This avoids contention on frequent inputs
+        (default: False).
+      embedding_dtype: optional dtype (e.g. `jnp.int8`) in which the embedding
+        is stored. Every embedding is then scaled by an additional
+        `embedding_scale` parameter of shape `(num_embeddings,)`
+        (default: None, the embedding is stored in full precision).
 
     Returns:
       Output which is embedded input data.  The output shape follows the input,
@@ -386,8 +1084,31 @@ class Embed(base.Module):
     """
     if not jnp.issubdtype(inputs.dtype, jnp.integer):
       raise ValueError('Input type must be an integer or unsigned integer.')
-    embedding = self.param('embedding', (num_embeddings, features),
-                           embedding_init)
+    if sorted_grad and (one_hot or embedding_dtype is not None):
+      raise ValueError('sorted_grad only applies to the gather lookup of a '
+                       'full precision embedding, it cannot be combined with '
+                       'one_hot or embedding_dtype.')
+    embedding_shape = (num_embeddings, features)
+    if embedding_dtype is None:
+      embedding = self.param('embedding', embedding_shape, embedding_init)
+    else:
+      embedding, scale = _quantized_param(
+          self, 'embedding', embedding_shape, embedding_init, embedding_dtype,
+          (1,))
+    if embedding_dtype is not None and not one_hot:
+      # Gathering the quantized rows and their scales lets XLA fuse the
+      # dequantization into the gather, such that every row is read once.
+      return (jnp.asarray(embedding[inputs], scale.dtype) *
+              jnp.expand_dims(scale[inputs], -1))
+    if embedding_dtype is not None:
+      embedding = _dequantize_rows(embedding, scale)
+    if one_hot:
+      x = jax.nn.one_hot(inputs, num_embeddings, dtype=embedding.dtype)
+      # Highest precision keeps the selected rows exact.
+      return lax.dot_general(x, embedding, (((x.ndim - 1,), (0,)), ((), ())),
+                             precision=lax.Precision.HIGHEST)
+    if sorted_grad:
+      return _sorted_grad_lookup(embedding, inputs)
     return embedding[inputs]
 
   @base.module_method
@@ -407,5 +1128,12 @@ class Embed(base.Module):
     """
     del unused_kwargs
     embedding = self.get_param('embedding')
+    try:
+      scale = self.get_param('embedding_scale')
+    except ValueError:
+      scale = None
+    if scale is not None:
+      # The embedding was stored in a narrow `embedding_dtype`.
+      embedding = _dequantize_rows(embedding, scale)
     return lax.dot_general(
         query, embedding, (((query.ndim - 1,), (1,)), ((), ())))
@@ -110,10 +110,10 @@ class LSTMCell(RNNCellBase):
     hidden_features = h.shape[-1]
     # input and recurrent layers are summed so only one needs a bias.
     dense_h = linear.Dense.partial(
-        inputs=h, features=hidden_features, bias=True,
+        inputs=h, features=hidden_features, bias=True, dtype=jnp.float32,
         kernel_init=recurrent_kernel_init, bias_init=bias_init)
     dense_i = linear.Dense.partial(
-        inputs=inputs, features=hidden_features, bias=False,
+        inputs=inputs, features=hidden_features, bias=False, dtype=jnp.float32,
         kernel_init=kernel_init)
     i = gate_fn(dense_i(name='ii') + dense_h(name='hi'))
     f = gate_fn(dense_i(name='if') + dense_h(name='hf'))
@@ -308,10 +308,10 @@ class GRUCell(RNNCellBase):
     hidden_features = h.shape[-1]
     # input and recurrent layers are summed so only one needs a bias.
     dense_h = linear.Dense.partial(
-        inputs=h, features=hidden_features, bias=False,
+        inputs=h, features=hidden_features, bias=False, dtype=jnp.float32,
         kernel_init=recurrent_kernel_init, bias_init=bias_init)
     dense_i = linear.Dense.partial(
-        inputs=inputs, features=hidden_features, bias=True,
+        inputs=inputs, features=hidden_features, bias=True, dtype=jnp.float32,
         kernel_init=kernel_init, bias_init=bias_init)
     r = gate_fn(dense_i(name='ir') + dense_h(name='hr'))
     z = gate_fn(dense_i(name='iz') + dense_h(name='hz'))
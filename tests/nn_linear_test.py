@@ -14,8 +14,6 @@
 
 """Tests for flax.nn.linear."""
 
-import functools
-
 from absl.testing import absltest
 from absl.testing import parameterized
 
@@ -68,16 +66,23 @@ class LinearTest(parameterized.TestCase):
     y, _ = dense_module.init(rng, x)
     np.testing.assert_allclose(y, np.full((1, 4), 3.))
 
+  def test_dense_sequence_inputs(self):
+    y, _ = nn.Dense.init(random.PRNGKey(0), [[1., 2.]], features=3,
+                         kernel_init=initializers.ones)
+    np.testing.assert_allclose(y, np.full((1, 3), 3.))
+
   def test_dense_is_dense_general(self):
     x = jax.random.normal(random.PRNGKey(0), (5, 3))
     dense_module = nn.Dense.partial(
         features=4,
+        dtype=jnp.float32,
         bias=True,
         bias_init=initializers.normal(),
     )
     y1, _ = dense_module.init(random.PRNGKey(1), x)
     dg_module = nn.DenseGeneral.partial(
         features=4,
+        dtype=jnp.float32,
         bias=True,
         bias_init=initializers.normal(),
     )
@@ -85,6 +90,157 @@ class LinearTest(parameterized.TestCase):
 
     np.testing.assert_allclose(y1, y2)
 
+  @parameterized.parameters([jnp.float8_e4m3fn, jnp.int8])
+  def test_dense_weight_dtype(self, weight_dtype):
+    x = jax.random.normal(random.PRNGKey(0), (5, 3))
+    dense_module = nn.Dense.partial(
+        features=4,
+        dtype=jnp.float32,
+        kernel_init=initializers.normal(),
+    )
+    y1, _ = dense_module.init(random.PRNGKey(1), x)
+    y2, params = dense_module.init(random.PRNGKey(1), x,
+                                   weight_dtype=weight_dtype)
+    self.assertEqual(params['kernel'].dtype, weight_dtype)
+    self.assertEqual(params['kernel_scale'].shape, (4,))
+    np.testing.assert_allclose(y1, y2, atol=5e-3)
+
+  @parameterized.parameters([16, 256])
+  def test_dense_weight_bits(self, in_features):
+    x = jax.random.normal(random.PRNGKey(0), (5, in_features))
+    def kernel_init(rng, shape):
+      del rng
+      # Every group of 16 rows covers all 16 levels of each column, such that
+      # the kernel is exactly representable.
+      i, j = np.indices(shape)
+      return jnp.asarray((i * 7 + j) % 16 * .125 - 1., jnp.float32)
+    dense_module = nn.Dense.partial(
+        features=6,
+        dtype=jnp.float32,
+        precision=jax.lax.Precision.HIGHEST,
+        kernel_init=kernel_init,
+    )
+    y1, _ = dense_module.init(random.PRNGKey(1), x)
+    y2, params = dense_module.init(random.PRNGKey(1), x, weight_bits=4)
+    n_groups = max(in_features // 128, 1)
+    self.assertEqual(params['kernel'].shape, (in_features, 3))
+    self.assertEqual(params['kernel'].dtype, jnp.uint8)
+    self.assertEqual(params['kernel_scale'].shape, (n_groups, 6))
+    self.assertEqual(params['kernel_zero'].shape, (n_groups, 6))
+    np.testing.assert_allclose(y1, y2, atol=1e-5, rtol=1e-5)
+
+  def test_dense_weight_bits_odd_features_raises(self):
+    x = jnp.ones((1, 8))
+    with self.assertRaises(ValueError):
+      nn.Dense.init(random.PRNGKey(0), x, features=3, weight_bits=4)
+
+  @parameterized.parameters([((-2, 3), ()), ((-2, 3), (0,))])
+  def test_dense_general_weight_dtype(self, axis, batch_dims):
+    x = jax.random.normal(random.PRNGKey(0), (4, 3, 5, 6))
+    dg_module = nn.DenseGeneral.partial(
+        features=(2, 7),
+        dtype=jnp.float32,
+        axis=axis,
+        batch_dims=batch_dims,
+        kernel_init=initializers.normal(),
+    )
+    y1, _ = dg_module.init(random.PRNGKey(1), x)
+    y2, params = dg_module.init(random.PRNGKey(1), x, weight_dtype=jnp.int8)
+    batch_shape = x.shape[:len(batch_dims)]
+    self.assertEqual(params['kernel'].dtype, jnp.int8)
+    self.assertEqual(params['kernel_scale'].shape, batch_shape + (2, 7))
+    np.testing.assert_allclose(y1, y2, atol=5e-3)
+
+  def test_dense_num_heads(self):
+    x = jax.random.normal(random.PRNGKey(0), (3, 2, 5, 4))
+    dense_module = nn.Dense.partial(
+        features=6,
+        num_heads=3,
+        dtype=jnp.float32,
+        bias_init=initializers.normal(),
+    )
+    y, params = dense_module.init(random.PRNGKey(1), x)
+    kernel, bias = params['kernel'], params['bias']
+    self.assertEqual(kernel.shape, (3, 4, 6))
+    self.assertEqual(bias.shape, (3, 6))
+    self.assertFalse(np.allclose(kernel[0], kernel[1]))
+    target = np.einsum('hbij,hjk->hbik', x, kernel) + bias[:, None, None]
+    np.testing.assert_allclose(y, target, atol=1e-5)
+
+  def test_dense_single_head(self):
+    x = jax.random.normal(random.PRNGKey(0), (1, 2, 4))
+    y, params = nn.Dense.init(random.PRNGKey(1), x, features=6, num_heads=1,
+                              dtype=jnp.float32)
+    self.assertEqual(params['kernel'].shape, (1, 4, 6))
+    self.assertEqual(params['bias'].shape, (1, 6))
+    target = np.einsum('hbj,hjk->hbk', x, params['kernel'])
+    np.testing.assert_allclose(y, target, atol=1e-5)
+
+  def test_dense_num_heads_mismatch_raises(self):
+    x = jnp.ones((2, 4))
+    with self.assertRaises(ValueError):
+      nn.Dense.init(random.PRNGKey(0), x, features=3, num_heads=3)
+
+  def test_dense_fp8_training(self):
+    x = jax.random.normal(random.PRNGKey(0), (4, 16))
+    dense_module = nn.Dense.partial(
+        features=8,
+        dtype=jnp.float32,
+        fp8_history_length=3,
+    )
+    with nn.stateful() as state:
+      y1, params = dense_module.init(random.PRNGKey(1), x)
+    history = state.as_dict()['/']['input_amax_history']
+    np.testing.assert_allclose(history, np.zeros(3))
+
+    def loss_fn(params, state):
+      with nn.stateful(state) as new_state:
+        y = dense_module.call(params, x)
+      return jnp.sum(y ** 2), new_state
+
+    (_, state), grads = jax.value_and_grad(loss_fn, has_aux=True)(
+        params, state)
+    amax = np.max(np.abs(x))
+    history = state.as_dict()['/']['input_amax_history']
+    np.testing.assert_allclose(history, [amax, 0., 0.])
+    self.assertEqual(grads['kernel'].shape, (16, 8))
+    self.assertTrue(np.all(np.isfinite(grads['kernel'])))
+
+    y2 = nn.Dense.call(params, x, features=8, dtype=jnp.float32)
+    np.testing.assert_allclose(y1, y2, rtol=0.1, atol=0.1)
+
+  def test_dense_fp8_training_requires_state(self):
+    x = jnp.ones((1, 4))
+    with self.assertRaises(ValueError):
+      nn.Dense.init(random.PRNGKey(0), x, features=3, fp8_history_length=4)
+
+  def test_dense_mxfp8(self):
+    x = jax.random.normal(random.PRNGKey(0), (5, 64))
+    dense_module = nn.Dense.partial(
+        features=6,
+        dtype=jnp.float32,
+        precision=jax.lax.Precision.HIGHEST,
+    )
+    y1, _ = dense_module.init(random.PRNGKey(1), x)
+    y2, params = dense_module.init(random.PRNGKey(1), x, mxfp8=True)
+    self.assertEqual(params['kernel'].shape, (64, 6))
+    self.assertEqual(params['kernel'].dtype, jnp.float8_e4m3fn)
+    self.assertEqual(params['kernel_scale'].shape, (2, 6))
+    self.assertEqual(params['kernel_scale'].dtype, jnp.uint8)
+    self.assertLess(np.linalg.norm(y1 - y2) / np.linalg.norm(y1), 0.05)
+
+  def test_dense_mxfp8_block_size_raises(self):
+    x = jnp.ones((1, 48))
+    with self.assertRaises(ValueError):
+      nn.Dense.init(random.PRNGKey(0), x, features=3, mxfp8=True)
+
+  def test_dense_default_dtype(self):
+    x = jnp.ones((2, 3))
+    y, params = nn.Dense.init(random.PRNGKey(0), x, features=4)
+    self.assertEqual(y.dtype, jnp.bfloat16)
+    self.assertEqual(params['kernel'].dtype, jnp.float32)
+    self.assertEqual(params['bias'].dtype, jnp.float32)
+
   def test_dense_general_batch_dim_raises(self):
     rng = random.PRNGKey(0)
     x = jnp.ones((1, 3, 2, 5))
@@ -124,34 +280,39 @@ class LinearTest(parameterized.TestCase):
     rng = random.PRNGKey(0)
     x = jnp.ones((2, 1, 3, 5))
 
-    state = {'counter': 0.}
-    def _counter_init(rng, shape, dtype, state):
-      del rng, dtype
-      state['counter'] += 1.
-      return jnp.full(shape, state['counter'])
-    counter_init = functools.partial(_counter_init, state=state)
-
     dg_module = nn.DenseGeneral.partial(
         features=7,
+        dtype=jnp.float32,
         axis=(3, -2),
         batch_dims=0,
-        bias_init=initializers.ones,
-        kernel_init=counter_init,
+        bias_init=initializers.normal(),
+        kernel_init=initializers.normal(),
     )
-    y, _ = dg_module.init(rng, x)
-    target = np.concatenate(
-        [np.full((1, 1, 7), 16.), np.full((1, 1, 7), 31.)], axis=0)
-    np.testing.assert_allclose(y, target)
+    y, initial_params = dg_module.init(rng, x)
+    kernel, bias = initial_params['kernel'], initial_params['bias']
+    self.assertEqual(kernel.shape, (2, 5, 3, 7))
+    self.assertEqual(bias.shape, (2, 7))
+    # Every batch entry is initialized with its own rng.
+    self.assertFalse(np.allclose(kernel[0], kernel[1]))
+    self.assertFalse(np.allclose(bias[0], bias[1]))
+    target = np.einsum('bijk,bkjl->bil', x, kernel) + bias[:, None]
+    np.testing.assert_allclose(y, target, atol=1e-6)
 
   @parameterized.parameters([((-2, 3), (), 'bijk,jklm->bilm'),
                              ((3, -2), (), 'bijk,kjlm->bilm'),
-                             ((-2, 3), (0,), 'bijk,bjklm->bilm')])
-  def test_dense_general_vs_numpy(self, axis, batch_dims, einsum_expr):
+                             ((-2, 3), (0,), 'bijk,bjklm->bilm'),
+                             ((-2, -1), (0, 1), 'bijk,bijklm->bilm'),
+                             ((-3, -2, -1), (), 'bijk,ijklm->blm'),
+                             ((1,), (), 'bijk,ilm->bjklm'),
+                             ((-2, -1), (), 'bijk,jklm->bilm', 0)])
+  def test_dense_general_vs_numpy(self, axis, batch_dims, einsum_expr,
+                                  batch_size=16):
     rng = random.PRNGKey(0)
-    x = jnp.ones((16, 8, 9, 10))
+    x = jnp.ones((batch_size, 8, 9, 10))
 
     dg_module = nn.DenseGeneral.partial(
         features=(11, 12),
+        dtype=jnp.float32,
         axis=axis,
         batch_dims=batch_dims,
         bias_init=initializers.ones,
@@ -162,6 +323,23 @@ class LinearTest(parameterized.TestCase):
     target = np.einsum(einsum_expr, x, dg_module.params['kernel']) + 1.
     np.testing.assert_allclose(y, target, atol=1e-6)
 
+  @parameterized.parameters([((-2, -1), (), 7), ((3, -3), (0,), 2),
+                             ((-1,), (), 3), ((3, 1), (), 2)])
+  def test_dense_general_contract_block_size(self, axis, batch_dims,
+                                             block_size):
+    x = jax.random.normal(random.PRNGKey(0), (2, 3, 4, 5))
+    dg_module = nn.DenseGeneral.partial(
+        features=(6,),
+        dtype=jnp.float32,
+        axis=axis,
+        batch_dims=batch_dims,
+        precision=jax.lax.Precision.HIGHEST,
+    )
+    y1, _ = dg_module.init(random.PRNGKey(1), x)
+    y2, _ = dg_module.init(random.PRNGKey(1), x,
+                           contract_block_size=block_size)
+    np.testing.assert_allclose(y1, y2, atol=1e-5)
+
   @parameterized.parameters([((3,),), (3,)])
   def test_conv(self, kernel_size):
     rng = random.PRNGKey(0)
@@ -178,6 +356,18 @@ class LinearTest(parameterized.TestCase):
     self.assertEqual(model.params['kernel'].shape, (3, 3, 4))
     np.testing.assert_allclose(y, np.full((1, 6, 4), 10.))
 
+  @parameterized.parameters([jnp.float32, jnp.bfloat16])
+  def test_conv_bias_dtype(self, dtype):
+    x = jnp.ones((1, 8, 3))
+    y, params = nn.Conv.init(random.PRNGKey(0), x, features=4,
+                             kernel_size=(3,), dtype=dtype)
+    self.assertEqual(y.dtype, dtype)
+    self.assertEqual(params['kernel'].dtype, jnp.float32)
+    self.assertEqual(params['bias'].dtype, jnp.float32)
+    # The output dtype follows the compute dtype, not the stored params.
+    y = nn.Conv.call(params, x, features=4, kernel_size=(3,))
+    self.assertEqual(y.dtype, jnp.bfloat16)
+
   @parameterized.parameters([((3,),), (3,)])
   def test_single_input_conv(self, kernel_size):
     rng = random.PRNGKey(0)
@@ -211,6 +401,91 @@ class LinearTest(parameterized.TestCase):
     self.assertEqual(model.params['kernel'].shape, (3, 2, 4))
     np.testing.assert_allclose(y, np.full((1, 6, 4), 7.))
 
+  @parameterized.parameters([(1, (3,)), (2, (3, 3)), (4, (3, 2, 2))])
+  def test_conv_data_format(self, feature_group_count, kernel_size):
+    shape = (2,) + (6,) * len(kernel_size) + (4,)
+    x = jax.random.normal(random.PRNGKey(0), shape)
+    conv_module = nn.Conv.partial(
+        features=8,
+        dtype=jnp.float32,
+        kernel_size=kernel_size,
+        feature_group_count=feature_group_count,
+    )
+    y1, _ = conv_module.init(random.PRNGKey(1), x, data_format='NHWC')
+    y2, _ = conv_module.init(random.PRNGKey(1), x, data_format='NCHW')
+    self.assertEqual(y1.shape, x.shape[:-1] + (8,))
+    np.testing.assert_allclose(y1, y2, atol=1e-5)
+
+  @parameterized.parameters([dict(data_format='NWC'),
+                             dict(data_format='NCHW', winograd=True),
+                             dict(data_format='NCHW', im2col=True)])
+  def test_conv_data_format_raises(self, **kwargs):
+    x = jnp.ones((1, 6, 6, 2))
+    with self.assertRaises(ValueError):
+      nn.Conv.init(random.PRNGKey(0), x, features=4, kernel_size=(3, 3),
+                   **kwargs)
+
+  @parameterized.parameters([
+      dict(kernel_size=(3,), strides=(2,), kernel_dilation=None,
+           feature_group_count=1),
+      dict(kernel_size=(3, 2), strides=(1, 2), kernel_dilation=(2, 1),
+           feature_group_count=2),
+      dict(kernel_size=(2, 2, 2), strides=None, kernel_dilation=None,
+           feature_group_count=4),
+  ])
+  def test_im2col_conv(self, kernel_size, strides, kernel_dilation,
+                       feature_group_count):
+    shape = (2,) + (7,) * len(kernel_size) + (4,)
+    x = jax.random.normal(random.PRNGKey(0), shape)
+    conv_module = nn.Conv.partial(
+        features=8,
+        dtype=jnp.float32,
+        kernel_size=kernel_size,
+        strides=strides,
+        kernel_dilation=kernel_dilation,
+        feature_group_count=feature_group_count,
+        precision=jax.lax.Precision.HIGHEST,
+    )
+    y1, _ = conv_module.init(random.PRNGKey(1), x)
+    y2, _ = conv_module.init(random.PRNGKey(1), x, im2col=True)
+    self.assertEqual(y1.shape, y2.shape)
+    np.testing.assert_allclose(y1, y2, atol=1e-5)
+
+  @parameterized.parameters([('SAME', 1), ('VALID', 1), (((2, 0), (1, 3)), 2)])
+  def test_winograd_conv(self, padding, feature_group_count):
+    x = jax.random.normal(random.PRNGKey(0), (2, 7, 6, 4))
+    conv_module = nn.Conv.partial(
+        features=6,
+        dtype=jnp.float32,
+        kernel_size=(3, 3),
+        padding=padding,
+        feature_group_count=feature_group_count,
+        precision=jax.lax.Precision.HIGHEST,
+        bias_init=initializers.normal(),
+    )
+    y1, _ = conv_module.init(random.PRNGKey(1), x)
+    y2, params = conv_module.init(random.PRNGKey(1), x, winograd=True)
+    self.assertEqual(params['kernel'].shape,
+                     (3, 3, 4 // feature_group_count, 6))
+    self.assertEqual(y1.shape, y2.shape)
+    np.testing.assert_allclose(y1, y2, atol=1e-5)
+
+    # The layer stays a convolution after a gradient step.
+    def loss_fn(params):
+      y = conv_module.call(params, x, winograd=True)
+      return jnp.sum(y * jnp.arange(y.size).reshape(y.shape) / y.size)
+    grads = jax.grad(loss_fn)(params)
+    params = jax.tree_map(lambda p, g: p - g, params, grads)
+    y1 = conv_module.call(params, x)
+    y2 = conv_module.call(params, x, winograd=True)
+    np.testing.assert_allclose(y1, y2, atol=1e-4)
+
+  def test_winograd_conv_unsupported_raises(self):
+    x = jnp.ones((1, 8, 8, 3))
+    with self.assertRaises(ValueError):
+      nn.Conv.init(random.PRNGKey(0), x, features=4, kernel_size=(3, 3),
+                   strides=(2, 2), winograd=True)
+
   @parameterized.parameters([((3,),), (3,)])
   def test_conv_transpose(self, kernel_size):
     rng = random.PRNGKey(0)
@@ -280,6 +555,59 @@ class LinearTest(parameterized.TestCase):
     z = model.attend(jnp.ones((3,)))
     np.testing.assert_allclose(z, 3. * jnp.arange(4))
 
+  def test_embed_one_hot(self):
+    x = jax.random.randint(random.PRNGKey(0), (2, 5), 0, 10)
+    embed_module = nn.Embed.partial(num_embeddings=10, features=3)
+    y1, params = embed_module.init(random.PRNGKey(1), x, one_hot=False)
+    y2, _ = embed_module.init(random.PRNGKey(1), x, one_hot=True)
+    self.assertEqual(y2.shape, (2, 5, 3))
+    np.testing.assert_allclose(y1, params['embedding'][x])
+    np.testing.assert_allclose(y1, y2)
+
+  def test_embed_sorted_grad(self):
+    # Includes out of range ids, which get no gradient.
+    x = jnp.array([[3, 7, -1], [-6, 0, 3]])
+    embed_module = nn.Embed.partial(num_embeddings=5, features=2,
+                                    one_hot=False)
+    _, params = embed_module.init(random.PRNGKey(0), x)
+    def loss_fn(params, sorted_grad):
+      y = embed_module.call(params, x, sorted_grad=sorted_grad)
+      return jnp.sum(y * jnp.arange(1., 7.).reshape(2, 3, 1))
+    y1 = embed_module.call(params, x, sorted_grad=False)
+    y2 = embed_module.call(params, x, sorted_grad=True)
+    np.testing.assert_allclose(y1, y2)
+    g1 = jax.grad(loss_fn)(params, False)
+    g2 = jax.grad(loss_fn)(params, True)
+    np.testing.assert_allclose(g1['embedding'], g2['embedding'])
+
+  @parameterized.parameters([dict(one_hot=True),
+                             dict(embedding_dtype=jnp.int8)])
+  def test_embed_sorted_grad_raises(self, **kwargs):
+    x = jnp.array([[3, 1]])
+    with self.assertRaises(ValueError):
+      nn.Embed.init(random.PRNGKey(0), x, num_embeddings=5, features=2,
+                    sorted_grad=True, **kwargs)
+
+  @parameterized.parameters([False, True])
+  def test_embed_quantized(self, one_hot):
+    x = jax.random.randint(random.PRNGKey(0), (2, 5), 0, 10)
+    embed_module = nn.Embed.partial(num_embeddings=10, features=3,
+                                    one_hot=one_hot)
+    y1, params1 = embed_module.init(random.PRNGKey(1), x)
+    y2, params = embed_module.init(random.PRNGKey(1), x,
+                                   embedding_dtype=jnp.int8)
+    self.assertEqual(params['embedding'].dtype, jnp.int8)
+    self.assertEqual(params['embedding_scale'].shape, (10,))
+    np.testing.assert_allclose(y1, y2, atol=1e-2)
+    model1 = nn.Model(embed_module, params1)
+    model2 = nn.Model(embed_module, params)
+    query = jax.random.normal(random.PRNGKey(2), (3,))
+    z1 = model1.attend(query)
+    z2 = model2.attend(query)
+    self.assertEqual(z2.shape, (10,))
+    self.assertEqual(z2.dtype, jnp.float32)
+    np.testing.assert_allclose(z1, z2, atol=5e-2)
+
 
 if __name__ == '__main__':
   absltest.main()